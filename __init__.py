@@ -1 +1 @@
-__all__ = ['file_io', 'analyze', 'plot']
\ No newline at end of file
+__all__ = ['file_io', 'analyze', 'plot', 'stats', 'circadian', 'server']
\ No newline at end of file
@@ -5,9 +5,85 @@ Created on Mar 6, 2014
 """
 
 import datetime as dt
+import multiprocessing
+
+import numpy as np
 import pandas as pd
 
 
+MINUTES_PER_DAY = 1440
+PHASES = ['L', 'D', 'total']  # per-day phases reported by calculate_daily_totals
+MIN_CHECK_MINUTES = 720  # recorded minutes needed on check_day to call a fly dead
+SWEEP_THRESHOLDS = range(1, 31)  # minutes of inactivity tried by sweep_sleep_thresholds
+
+
+def align_monitors(DEnM_df, DAM_dict):
+    """
+    Reindex every DAM df onto one regular per-minute grid spanning the DEnM
+    data.  Each monitor's timestamps are converted to integer minute offsets
+    from the start of the grid and checked for gaps and duplicates in a single
+    sorted pass; readings are then scattered onto the grid by offset instead of
+    by label lookup.  Missing minutes are left as NaN, and for duplicated
+    minutes the last reading in the file is kept.
+
+    align_monitors(DEnM_df, DAM_dict) -> (aligned_dict, gap_list)
+
+    input DEnM_df:       pd.dataframe of data from DEnM file
+    input DAM_dict:      pd.dataframe of data from all DAM files in folder
+    output aligned_dict: monitors as keys and minute-gridded pd.dataframe as value
+    output gap_list:     (monitor, type, minute, count) tuples, where type is
+                         'gap' (count = missing minutes from minute on) or
+                         'duplicate' (count = readings for minute)
+    """
+
+    # the grid runs from the first to the last DEnM minute
+    grid_start = np.datetime64(DEnM_df.index[0], 'm')
+    grid_end = np.datetime64(DEnM_df.index[-1], 'm')
+    n_minutes = int((grid_end - grid_start).astype(int)) + 1
+    grid = pd.date_range(grid_start.astype(dt.datetime), periods=n_minutes,
+                         freq='1Min')
+
+    aligned = dict()
+    gaps = []
+    for monitor in sorted(DAM_dict):
+        df = DAM_dict[monitor]
+
+        # integer minutes since the start of the grid, in file order
+        stamps = df.index.values.astype('datetime64[m]')
+        offsets = (stamps - grid_start).astype(int)
+
+        # stable sort, then keep only the last reading in the file for each
+        # minute
+        order = np.argsort(offsets, kind='mergesort')
+        offsets = offsets[order]
+        keep = np.append(offsets[1:] != offsets[:-1], True)
+
+        # report each duplicated minute once, with the number of readings
+        kept = np.flatnonzero(keep)
+        readings = np.diff(np.concatenate(([-1], kept)))
+        for i in np.flatnonzero(readings > 1):
+            duplicate = grid[0] + dt.timedelta(minutes=int(offsets[kept[i]]))
+            print '%s: %d readings at %s' % (monitor, readings[i], duplicate)
+            gaps.append((monitor, 'duplicate', duplicate, int(readings[i])))
+
+        # report missing minutes inside the grid, including at either end
+        bounded = np.concatenate(([-1], np.clip(offsets, -1, n_minutes), [n_minutes]))
+        bounded_steps = np.diff(bounded)
+        for i in np.flatnonzero(bounded_steps > 1):
+            missing = int(bounded_steps[i]) - 1
+            first_missing = grid[0] + dt.timedelta(minutes=int(bounded[i]) + 1)
+            print '%s: %d missing minute(s) from %s' % (monitor, missing, first_missing)
+            gaps.append((monitor, 'gap', first_missing, missing))
+
+        # scatter the readings onto the grid; readings outside it are dropped
+        inside = keep & (offsets >= 0) & (offsets < n_minutes)
+        values = np.full((n_minutes, df.shape[1]), np.nan)
+        values[offsets[inside]] = df.values[order][inside]
+        aligned[monitor] = pd.DataFrame(values, index=grid, columns=df.columns)
+
+    return aligned, gaps
+
+
 def aggregate_by_genotype(genotype_dict, config_dict, DEnM_df, DAM_dict):
     """
     Create a dict of genotypes with a datetime indexed df for each fly.
@@ -17,16 +93,12 @@ def aggregate_by_genotype(genotype_dict, config_dict, DEnM_df, DAM_dict):
     input genotype_dict:  genotypes as keys and (monitor, first channel, last channel) tuples as values
     input config_dict:    configuration values
     input DEnM_df:        pd.dataframe of data from DEnM file
-    input DAM_dict:       pd.dataframe of data from all DAM files in folder
+    input DAM_dict:       pd.dataframe of data from all DAM files in folder,
+                          aligned to the DEnM minute grid by align_monitors
     output activity_dict: genotypes as keys and pd.dataframe of activity data as value
     """
 
     activity = dict()
-    # only collect data for which the environmental monitor status is
-    # good, i.e. status isn't 51 (unreachable)
-    # disabling for present
-    # time_series = DEnM_df.index[DEnM_df['status'] != 51]
-    time_series = DEnM_df.index
 
     for genotype in genotype_dict:
         for (monitor, first, last) in genotype_dict[genotype]:
@@ -46,7 +118,9 @@ def aggregate_by_genotype(genotype_dict, config_dict, DEnM_df, DAM_dict):
             # get the headers for the desired channels and append these channels
             channels = ['M' + monitor + 'C' + str(channel)
                         for channel in xrange(int(first), int(last) + 1)]
-            channels_df = DAM_dict['M' + str(monitor)].ix[time_series, channels]
+            # monitors share one index after alignment, so this is a plain
+            # column selection rather than a per-timestamp lookup
+            channels_df = DAM_dict['M' + str(monitor)][channels]
             if genotype not in activity:
                 activity[genotype] = channels_df
             else:
@@ -60,15 +134,53 @@ def mark_dead_flies(protocol_dict, DEnM_df, activity_dict, genotype_dict):
     """
     Given the activity_dict of dfs and a day to check, looks for
     channels for which there is no activity on check_date and deletes
-    dead fly columns from the df.  Mutates activity_dict.
+    dead fly columns from the df.  Flies with too little data on check_date
+    to decide are kept, and listed separately.  Mutates activity_dict.
 
-    mark_dead_flies(protocol_dict, DEnM_df, activity_dict, genotype_dict) -> dead_flies_list
+    mark_dead_flies(protocol_dict, DEnM_df, activity_dict, genotype_dict) -> (dead_flies_list, undetermined_list)
+
+    input protocol_dict:      information about the protocol used for this experiment
+    input DEnM_df:            pd.dataframe of data from DEnM file
+    input activity_dict:      genotypes as keys and pd.dataframe of activity data as value
+    input genotype_dict:      genotypes as keys and (monitor, first channel, last channel) tuples as values
+    output dead_flies_list:   list of dead fly positions
+    output undetermined_list: list of fly positions that couldn't be checked
+    """
 
-    input protocol_dict:    information about the protocol used for this experiment
-    input DEnM_df:          pd.dataframe of data from DEnM file
-    input activity_dict:    genotypes as keys and pd.dataframe of activity data as value
-    input genotype_dict:    genotypes as keys and (monitor, first channel, last channel) tuples as values
-    output dead_flies_list: list of dead fly positions
+    (dead, undetermined) = find_dead_flies(protocol_dict, DEnM_df, activity_dict)
+    dead_flies = []
+    for (genotype, channel) in dead:
+        # we should be alerted about dead flies
+        print '%s:%s - dead' % (genotype, channel)
+        dead_flies.append('_'.join([genotype, channel]))
+        # and the data for the dead fly should be deleted
+        del activity_dict[genotype][channel]
+    for (genotype, channel) in undetermined:
+        print '%s:%s - undetermined, too little data on check_day' % (genotype, channel)
+    for genotype in list(activity_dict):
+        # if all flies of this genotype is dead, warn us and delete the df
+        if activity_dict[genotype].shape[1] == 0:
+            print 'All flies of genotype %s are dead.' % genotype
+            del activity_dict[genotype]
+            del genotype_dict[genotype]
+    return dead_flies, ['_'.join(fly) for fly in undetermined]
+
+
+def find_dead_flies(protocol_dict, DEnM_df, activity_dict, threshold=0):
+    """
+    Return the flies whose total activity on check_day is at most threshold
+    beam crossings.  Missing minutes are NaN and say nothing either way, so
+    flies with fewer than MIN_CHECK_MINUTES recorded minutes on check_day are
+    returned as undetermined instead.  Doesn't change activity_dict.
+
+    find_dead_flies(protocol_dict, DEnM_df, activity_dict, threshold) -> (dead_flies_list, undetermined_list)
+
+    input protocol_dict:      information about the protocol used for this experiment
+    input DEnM_df:            pd.dataframe of data from DEnM file
+    input activity_dict:      genotypes as keys and pd.dataframe of activity data as value
+    input threshold:          most beam crossings a dead fly can have on check_day
+    output dead_flies_list:   list of (genotype, channel) tuples
+    output undetermined_list: list of (genotype, channel) tuples
     """
 
     # determine the index to check from check_day
@@ -86,28 +198,22 @@ def mark_dead_flies(protocol_dict, DEnM_df, activity_dict, genotype_dict):
         set check_day to an integer between 0 and the length of the experiment.
         '''
         print dead_fly_warning
-        return []
+        return [], []
     check_end = check_start + dt.timedelta(1)
 
     dead_flies = []
-    for genotype in activity_dict:
-        for channel in activity_dict[genotype]:
-            # take the set of all activity values for channel during check_date
-            # if the set only contains 0, then the fly is dead
-            channel_activity = set(activity_dict[genotype].ix[check_start:check_end][channel])
-            channel_activity.discard(0)
-            if not channel_activity:
-                # we should be alerted about dead flies
-                print '%s:%s - dead' % (genotype, channel)
-                dead_flies.append('_'.join([genotype, channel]))
-                # and the data for the dead fly should be deleted
-                del activity_dict[genotype][channel]
-        # if all flies of this genotype is dead, warn us and delete the df
-        if activity_dict[genotype].shape[1] == 0:
-            print 'All flies of genotype %s are dead.' % genotype
-            del activity_dict[genotype]
-            del genotype_dict[genotype]
-    return dead_flies
+    undetermined = []
+    for genotype in sorted(activity_dict):
+        # total activity and recorded minutes for every channel during check_date
+        window = activity_dict[genotype].ix[check_start:check_end]
+        totals = window.sum()
+        recorded = window.count()
+        for channel in totals.index:
+            if recorded[channel] < MIN_CHECK_MINUTES:
+                undetermined.append((genotype, channel))
+            elif totals[channel] <= threshold:
+                dead_flies.append((genotype, channel))
+    return dead_flies, undetermined
 
 
 def calculate_dates(protocol_dict, DEnM_df):
@@ -132,15 +238,107 @@ def calculate_dates(protocol_dict, DEnM_df):
     return dates, start_date, end_date
 
 
-def calculate_sleep(activity_dict):
+def minutes_by_day(protocol_dict, DEnM_df, df):
+    """
+    Return the data in df for every complete day of the experiment as a
+    (day, minute of day, fly) array.  Day 1 starts at the first lights_on, as
+    in the plots, and a partial last day is dropped.  Assumes df is on the
+    regular minute grid produced by align_monitors.
+
+    minutes_by_day(protocol_dict, DEnM_df, df) -> day_array
+
+    input protocol_dict: information about the protocol used for this experiment
+    input DEnM_df:       pd.dataframe of data from DEnM file
+    input df:            pd.dataframe of activity or sleep data for one genotype
+    output day_array:    np.array of shape (days, 1440, flies)
+    """
+
+    (__, start_date, end_date) = calculate_dates(protocol_dict, DEnM_df)
+    n_days = (end_date - start_date).days
+    first = df.index.searchsorted(start_date)
+    values = df.values[first:first + n_days * MINUTES_PER_DAY].astype(float)
+
+    # pad with NaN if the data stop before the last complete DEnM day
+    if values.shape[0] < n_days * MINUTES_PER_DAY:
+        padding = np.full((n_days * MINUTES_PER_DAY - values.shape[0],
+                           values.shape[1]), np.nan)
+        values = np.vstack((values, padding))
+    return values.reshape(n_days, MINUTES_PER_DAY, values.shape[1])
+
+
+def bin_by_day(protocol_dict, DEnM_df, df, bin_minutes):
+    """
+    Return the data in df for every complete day, summed into bin_minutes
+    minute bins, as a (day, bin, fly) array.  Bins with missing minutes are
+    NaN.  bin_minutes must divide a day evenly.
+
+    bin_by_day(protocol_dict, DEnM_df, df, bin_minutes) -> binned_array
+
+    input protocol_dict: information about the protocol used for this experiment
+    input DEnM_df:       pd.dataframe of data from DEnM file
+    input df:            pd.dataframe of activity or sleep data for one genotype
+    input bin_minutes:   bin size in minutes
+    output binned_array: np.array of shape (days, bins per day, flies)
+    """
+
+    assert (MINUTES_PER_DAY % bin_minutes == 0), \
+        'Bin size %s does not divide a day evenly.' % str(bin_minutes)
+    days = minutes_by_day(protocol_dict, DEnM_df, df)
+    return days.reshape(days.shape[0], MINUTES_PER_DAY // bin_minutes,
+                        bin_minutes, days.shape[2]).sum(axis=2)
+
+
+def calculate_daily_totals(protocol_dict, DEnM_df, data_dict):
+    """
+    Return a dict of per-fly totals for the L phase, D phase, and whole of
+    each complete day.  A total is NaN if any of its minutes are missing,
+    rather than a sum over the minutes that happen to be there.
+
+    calculate_daily_totals(protocol_dict, DEnM_df, data_dict) -> totals_dict
+
+    input protocol_dict: information about the protocol used for this experiment
+    input DEnM_df:       pd.dataframe of data from DEnM file
+    input data_dict:     activity_dict or sleep_dict
+    output totals_dict:  genotypes as keys and pd.dataframe as value, with flies
+                         as rows and (day, phase) columns, phase in ['L','D','total']
+    """
+
+    light_minutes = 60 * ((protocol_dict['lights_off'].hour -
+                           protocol_dict['lights_on'].hour) % 24)
+
+    totals_dict = dict()
+    for genotype in data_dict:
+        days = minutes_by_day(protocol_dict, DEnM_df, data_dict[genotype])
+        # NaN propagates through the sums, marking incomplete phases
+        light = days[:, :light_minutes, :].sum(axis=1)
+        dark = days[:, light_minutes:, :].sum(axis=1)
+
+        # interleave to (day, phase, fly) and flatten to a fly x column table
+        totals = np.concatenate((light[:, np.newaxis, :],
+                                 dark[:, np.newaxis, :],
+                                 (light + dark)[:, np.newaxis, :]), axis=1)
+        columns = pd.MultiIndex.from_tuples([(day, phase)
+                                             for day in xrange(1, days.shape[0] + 1)
+                                             for phase in PHASES],
+                                            names=['day', 'phase'])
+        totals_dict[genotype] = pd.DataFrame(totals.reshape(-1, days.shape[2]).T,
+                                             index=data_dict[genotype].columns,
+                                             columns=columns)
+    return totals_dict
+
+
+def calculate_sleep(activity_dict, threshold=5):
     """
     Return a dict of sleep dataframes.
-    Sleep is defined as 5+ consecutive minutes without beam-crossings.
-    The sleep df consists of int arrays where sleep = 1.
+    Sleep is defined as threshold+ (default 5+) consecutive minutes without
+    beam-crossings; every minute of such a run is sleep.  The sleep df
+    consists of float arrays where sleep = 1, wake = 0, and missing minutes
+    are NaN; missing minutes never count toward a run.
 
-    calculate_sleep(activity_dict) -> sleep_dict
+    calculate_sleep(activity_dict, threshold) -> sleep_dict
 
     input activity_dict: genotypes as keys and pd.dataframe of activity data as value
+    input threshold:     minutes without beam-crossings that count as sleep
     output sleep_dict:   genotypes as keys and pd.dataframe of sleep data as value
     """
 
@@ -148,44 +346,143 @@ def calculate_sleep(activity_dict):
 
     for genotype in activity_dict:
         df = activity_dict[genotype]
-
-        # create a new blank df with the same index as the activity df
-        sleep_dict[genotype] = pd.DataFrame(index=df.index)
-        channel_length = sleep_dict[genotype].shape[0]
-
-        # for each channel in the activity df, create a new boolean
-        # column in sleep
-        for channel in df:
-            sleep_dict[genotype][channel] = [0] * channel_length
-
-            # look for streaks of 5+ zeros by iterating through list
-            i = 0
-            while i < channel_length:
-                # if list of 5 doesn't end with zero, next
-                if ((i + 4 < channel_length) and
-                    (df[channel][i + 4] != 0)):
-                    i += 5
-                    continue
-                # if list of 5 doesn't start with zero, next 5
-                if df[channel][i] != 0:
-                    i += 5
-                    continue
-                # if list of 5 contains any non-zero values, next
-                if ((i + 4 < channel_length) and
-                    (df[channel][i + 1:i + 3].sum() != 0)):
-                    i += 5
-                    continue
-                # see how far we can extend the run of zeros
-                j = 4
-                while ((i + j + 1 < channel_length) and
-                       (df[channel][i + j + 1]) == 0):
-                    j += 1
-                # change runs of sleep to 1
-                sleep_dict[genotype][channel][i:i + j] = 1
-                # move to next beam crossing count
-                i = i + j + 1
+        activity = df.values.T.astype(float)
+        sleep = (_zero_run_lengths(activity) >= threshold).astype(float)
+        # missing minutes are neither sleep nor wake
+        sleep[np.isnan(activity)] = np.nan
+        sleep_dict[genotype] = pd.DataFrame(sleep.T, index=df.index, columns=df.columns)
     return sleep_dict
 
 
+def _zero_run_lengths(activity):
+    """
+    Label every minute with the length of the run of zeros it is in, in one
+    pass over all flies.  Non-zero and missing (NaN) minutes are labelled 0, so
+    missing minutes break runs.
+
+    _zero_run_lengths(activity) -> run_lengths
+
+    input activity:     np.array of activity, flies x minutes
+    output run_lengths: np.array of run lengths, flies x minutes
+    """
+
+    (n_flies, n_minutes) = activity.shape
+
+    # a False column after every row keeps runs from joining across flies
+    zero = activity == 0
+    zero = np.hstack((zero, np.zeros((n_flies, 1), dtype=bool))).ravel()
+
+    # start and length of every run of zeros
+    edges = np.diff(np.concatenate(([0], zero.astype(np.int8))))
+    starts = np.flatnonzero(edges == 1)
+    lengths = np.flatnonzero(edges == -1) - starts
+    run_lengths = np.zeros(zero.shape, dtype=int)
+    run_lengths[zero] = np.repeat(lengths, lengths)
+    return run_lengths.reshape(n_flies, n_minutes + 1)[:, :-1]
+
+
+def sweep_sleep_thresholds(protocol_dict, DEnM_df, activity_dict,
+                           thresholds=SWEEP_THRESHOLDS, processes=1):
+    """
+    Return the mean minutes of sleep per day for every genotype at every
+    inactivity threshold, using the same definition of sleep as
+    calculate_sleep, so the row for a threshold matches sleep_dict computed
+    with that threshold.  Each fly is decomposed into runs of zeros once, and
+    a histogram of run lengths per day gives the totals for all thresholds
+    together.  Days with missing minutes are left out of the means.  With
+    processes > 1 genotypes are spread over a process pool.
+
+    sweep_sleep_thresholds(protocol_dict, DEnM_df, activity_dict, thresholds,
+                           processes) -> sleep_cube
+
+    input protocol_dict: information about the protocol used for this experiment
+    input DEnM_df:       pd.dataframe of data from DEnM file
+    input activity_dict: genotypes as keys and pd.dataframe of activity data as value
+    input thresholds:    list of thresholds in minutes
+    input processes:     number of worker processes
+    output sleep_cube:   pd.dataframe indexed by (threshold, genotype), with
+                         days as columns; empty if there are no genotypes
+    """
+
+    genotypes = sorted(activity_dict)
+    if not genotypes:
+        return pd.DataFrame()
+    jobs = [(protocol_dict, DEnM_df, activity_dict[genotype], thresholds)
+            for genotype in genotypes]
+    results = map_jobs(_sweep_genotype, jobs, processes)
+
+    # stack into a (threshold, genotype, day) cube and flatten the first two
+    cube = np.concatenate([result[:, np.newaxis, :] for result in results], axis=1)
+    index = pd.MultiIndex.from_tuples([(threshold, genotype)
+                                       for threshold in thresholds
+                                       for genotype in genotypes],
+                                      names=['threshold', 'genotype'])
+    columns = pd.Index(range(1, cube.shape[2] + 1), name='day')
+    return pd.DataFrame(cube.reshape(-1, cube.shape[2]), index=index, columns=columns)
+
+
+def _sweep_genotype(job):
+    """
+    Mean minutes of sleep per day across the flies of one genotype, for each
+    threshold.
+
+    _sweep_genotype(job) -> sleep_array
+
+    input job:          (protocol_dict, DEnM_df, activity df of one genotype,
+                         thresholds)
+    output sleep_array: np.array of mean sleep, thresholds x days
+    """
+
+    (protocol_dict, DEnM_df, df, thresholds) = job
+    longest = max(thresholds)
+
+    # label runs over the whole recording, as calculate_sleep does, so that
+    # runs crossing the first lights_on or midnight are measured in full, then
+    # cut out the complete days
+    run_length = pd.DataFrame(_zero_run_lengths(df.values.T.astype(float)).T,
+                              index=df.index, columns=df.columns)
+    days = minutes_by_day(protocol_dict, DEnM_df, run_length)
+    missing = np.isnan(minutes_by_day(protocol_dict, DEnM_df, df)).any(axis=1)
+    (n_days, __, n_flies) = days.shape
+
+    # histogram of run lengths (capped at the longest threshold) per day and
+    # fly; minutes in runs of T+ is then a reverse cumulative sum over length
+    capped = np.minimum(np.nan_to_num(days), longest).astype(int)
+    bins = (np.arange(n_days * n_flies).reshape(n_days, 1, n_flies) * (longest + 1) +
+            capped)
+    counts = np.bincount(bins.ravel(), minlength=n_days * n_flies * (longest + 1))
+    counts = counts.reshape(n_days, n_flies, longest + 1)
+    at_least = np.cumsum(counts[:, :, ::-1], axis=2)[:, :, ::-1]
+
+    # days with missing minutes are left out, as in calculate_daily_totals
+    sleep = at_least[:, :, list(thresholds)].astype(float)
+    sleep[missing] = np.nan
+    with np.errstate(invalid='ignore'):
+        return np.nanmean(sleep, axis=1).T
+
+
+def map_jobs(function, jobs, processes=1):
+    """
+    Apply function to every job, spread over a process pool if processes > 1.
+    function must be defined at module level so that it can be sent to the
+    worker processes.
+
+    map_jobs(function, jobs, processes) -> result_list
+
+    input function:     function of one job
+    input jobs:         list of jobs
+    input processes:    number of worker processes
+    output result_list: list of results, in the order of jobs
+    """
+
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.map(function, jobs)
+        pool.close()
+        pool.join()
+        return results
+    return map(function, jobs)
+
+
 if __name__ == '__main__':
     pass
@@ -0,0 +1,245 @@
+"""
+Created on Oct 19, 2026
+"""
+
+import numpy as np
+import pandas as pd
+import analyze
+
+
+MAX_ELEMENTS = 20000000  # cap on the size of a chi-square phase matrix chunk
+MIN_DD_DAYS = 3  # complete days of DD needed, and at least two longest periods
+
+
+def analyze_rhythms(protocol_dict, DEnM_df, activity_dict, min_period=16,
+                    max_period=32, resolution=6, alpha=0.01, processes=1):
+    """
+    Run chi-square (Sokolove-Bushell) and Lomb-Scargle periodograms on the
+    free-running activity of every fly, from the start of DD to the end of the
+    experiment.  All flies are stacked into one matrix and every candidate
+    period is evaluated with matrix products; with processes > 1 the fly rows
+    are split over a process pool.  A fly is called rhythmic if both
+    periodograms have a significant peak.
+
+    analyze_rhythms(protocol_dict, DEnM_df, activity_dict, min_period,
+                    max_period, resolution, alpha, processes) -> (fly_df, genotype_df)
+
+    input protocol_dict: information about the protocol used for this experiment
+    input DEnM_df:       pd.dataframe of data from DEnM file
+    input activity_dict: genotypes as keys and pd.dataframe of activity data as value
+    input min_period:    shortest candidate period in hours
+    input max_period:    longest candidate period in hours
+    input resolution:    bin size in minutes, also the period step
+    input alpha:         significance level for the rhythmicity calls
+    input processes:     number of worker processes
+    output fly_df:       pd.dataframe of periods, powers, and calls per fly
+    output genotype_df:  pd.dataframe of rhythmicity and mean period per genotype
+    """
+
+    # DD begins on day DD, counting the loading date as day 0; periodograms
+    # need a few cycles of the longest period to find a peak
+    first_day = max(protocol_dict['DD'], 1) - 1
+    min_days = max(MIN_DD_DAYS, 2 * max_period / 24.0)
+    flies = []
+    rows = []
+    for genotype in sorted(activity_dict):
+        days = analyze.minutes_by_day(protocol_dict, DEnM_df, activity_dict[genotype])
+        if days.shape[0] - first_day < min_days:
+            dd_warning = '''
+            WARNING:
+            DD begins on day %d, leaving %d complete days of DD data, but at
+            least %g are needed.
+            Circadian rhythms can't be analyzed for this experiment.
+            ''' % (protocol_dict['DD'], max(days.shape[0] - first_day, 0), min_days)
+            print dd_warning
+            return pd.DataFrame(), pd.DataFrame()
+        dd = days[first_day:].reshape(-1, days.shape[2]).T
+        flies.extend((genotype, channel) for channel in activity_dict[genotype].columns)
+        rows.append(dd)
+    if not rows:
+        return pd.DataFrame(), pd.DataFrame()
+
+    # sum into bins; a bin with any missing minute is missing
+    activity = np.vstack(rows)
+    n_bins = activity.shape[1] // resolution
+    activity = activity[:, :n_bins * resolution].reshape(-1, n_bins, resolution).sum(axis=2)
+
+    periods = np.arange(min_period * 60, max_period * 60 + 1, resolution) // resolution
+    jobs = [(chunk, periods, alpha) for chunk in
+            np.array_split(activity, max(processes, 1)) if chunk.shape[0]]
+    results = analyze.map_jobs(_periodograms, jobs, processes)
+
+    fly_df = pd.concat([pd.DataFrame(result) for result in results], ignore_index=True)
+    for column in ['chi2_period', 'ls_period']:
+        fly_df[column] = fly_df[column] * resolution / 60.0
+    fly_df.insert(0, 'fly', [channel for (__, channel) in flies])
+    fly_df.insert(0, 'genotype', [genotype for (genotype, __) in flies])
+
+    # summarize per genotype, with periods averaged over rhythmic flies only
+    grouped = fly_df.groupby('genotype')
+    rhythmic = fly_df[fly_df['rhythmic']].groupby('genotype')
+    genotype_df = pd.DataFrame({'N': grouped.size(),
+                                'N_rhythmic': grouped['rhythmic'].sum(),
+                                'period_mean': rhythmic['chi2_period'].mean(),
+                                'period_sem': rhythmic['chi2_period'].std() /
+                                              np.sqrt(rhythmic.size()),
+                                'power_mean': rhythmic['chi2_power'].mean()},
+                               columns=['N', 'N_rhythmic', 'fraction_rhythmic',
+                                        'period_mean', 'period_sem', 'power_mean'])
+    genotype_df['fraction_rhythmic'] = genotype_df['N_rhythmic'] / genotype_df['N']
+    return fly_df, genotype_df
+
+
+def _periodograms(job):
+    """
+    Find the chi-square and Lomb-Scargle peaks for a block of flies.
+
+    _periodograms(job) -> result_dict
+
+    input job:          (fly x bin activity array, periods in bins, alpha)
+    output result_dict: column name as key and np.array over flies as value
+    """
+
+    (activity, periods, alpha) = job
+    fly_index = np.arange(activity.shape[0])
+
+    # chi-square: report power above the significance threshold, as in ClockLab
+    qp = chi_square_periodogram(activity, periods)
+    relative = qp - chi_square_threshold(periods - 1, alpha)[np.newaxis, :]
+    chi2_peak = np.argmax(np.where(np.isnan(relative), -np.inf, relative), axis=1)
+    chi2_power = relative[fly_index, chi2_peak]
+
+    # Lomb-Scargle: false alarm probability of the highest peak
+    ls = lomb_scargle_periodogram(activity, periods)
+    ls_peak = np.argmax(np.where(np.isnan(ls), -np.inf, ls), axis=1)
+    ls_power = ls[fly_index, ls_peak]
+    ls_p = 1 - (1 - np.exp(-ls_power)) ** len(periods)
+
+    return {'chi2_period': periods[chi2_peak],
+            'chi2_power': chi2_power,
+            'ls_period': periods[ls_peak],
+            'ls_power': ls_power,
+            'ls_p': ls_p,
+            'rhythmic': (chi2_power > 0) & (ls_p < alpha)}
+
+
+def chi_square_periodogram(activity, periods):
+    """
+    Return the Sokolove-Bushell Qp statistic for every fly and period.
+    For each period P the bins are folded into P phases; the phase sums for all
+    periods come from a single product of the activity with a 0/1 phase
+    membership matrix (split into chunks of periods to bound memory).  Missing
+    bins (NaN) are left out of the phase means.
+
+    chi_square_periodogram(activity, periods) -> qp
+
+    input activity: np.array of binned activity, flies x bins
+    input periods:  np.array of candidate periods, in bins
+    output qp:      np.array of Qp, flies x periods
+    """
+
+    valid = ~np.isnan(activity)
+    n = valid.sum(axis=1).astype(float)
+    mean = np.nansum(activity, axis=1) / n
+    centered = np.where(valid, activity - mean[:, np.newaxis], 0)
+    weights = valid.astype(float)
+    total_ss = (centered ** 2).sum(axis=1)
+    n_bins = activity.shape[1]
+
+    qp = []
+    for chunk in _period_chunks(periods, n_bins):
+        # phase of every bin for every period in the chunk, as column indices
+        # into one wide membership matrix
+        offsets = np.concatenate(([0], np.cumsum(chunk)))
+        bins = np.arange(n_bins)
+        columns = offsets[:-1, np.newaxis] + bins[np.newaxis, :] % chunk[:, np.newaxis]
+        membership = np.zeros((n_bins, offsets[-1]))
+        membership[np.tile(bins, len(chunk)), columns.ravel()] = 1
+
+        phase_sums = centered.dot(membership)
+        phase_counts = weights.dot(membership)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            between = np.where(phase_counts > 0, phase_sums ** 2 / phase_counts, 0)
+        qp.append(np.add.reduceat(between, offsets[:-1], axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return n[:, np.newaxis] * np.hstack(qp) / total_ss[:, np.newaxis]
+
+
+def _period_chunks(periods, n_bins):
+    """
+    Split periods into runs whose phase membership matrices stay under
+    MAX_ELEMENTS.
+
+    _period_chunks(periods, n_bins) -> chunk_list
+    """
+
+    chunks = []
+    start = 0
+    size = 0
+    for i, period in enumerate(periods):
+        if size and (size + period) * n_bins > MAX_ELEMENTS:
+            chunks.append(periods[start:i])
+            start = i
+            size = 0
+        size += period
+    chunks.append(periods[start:])
+    return chunks
+
+
+def chi_square_threshold(dof, alpha):
+    """
+    Return the upper alpha critical value of the chi-square distribution, by
+    the Wilson-Hilferty approximation (accurate to well under 1% for the
+    degrees of freedom of circadian periodograms).
+
+    chi_square_threshold(dof, alpha) -> threshold
+
+    input dof:        np.array of degrees of freedom
+    input alpha:      significance level
+    output threshold: np.array of critical values
+    """
+
+    # upper normal quantile, Abramowitz & Stegun 26.2.23
+    t = np.sqrt(-2 * np.log(alpha))
+    z = t - (2.515517 + 0.802853 * t + 0.010328 * t ** 2) / \
+        (1 + 1.432788 * t + 0.189269 * t ** 2 + 0.001308 * t ** 3)
+    dof = np.asarray(dof, dtype=float)
+    return dof * (1 - 2 / (9 * dof) + z * np.sqrt(2 / (9 * dof))) ** 3
+
+
+def lomb_scargle_periodogram(activity, periods):
+    """
+    Return the normalized Lomb-Scargle power for every fly and period.
+    Uses the least-squares form of the periodogram, which needs only sums of
+    products with the cos/sin matrices and so handles each fly's missing bins
+    (NaN) with a weight mask instead of a separate fit per fly.
+
+    lomb_scargle_periodogram(activity, periods) -> power
+
+    input activity: np.array of binned activity, flies x bins
+    input periods:  np.array of candidate periods, in bins
+    output power:   np.array of power, flies x periods
+    """
+
+    valid = ~np.isnan(activity)
+    n = valid.sum(axis=1).astype(float)
+    mean = np.nansum(activity, axis=1) / n
+    centered = np.where(valid, activity - mean[:, np.newaxis], 0)
+    weights = valid.astype(float)
+    variance = (centered ** 2).sum(axis=1) / (n - 1)
+
+    phase = np.outer(np.arange(activity.shape[1]), 2 * np.pi / periods)
+    cos = np.cos(phase)
+    sin = np.sin(phase)
+    yc = centered.dot(cos)
+    ys = centered.dot(sin)
+    cc = weights.dot(cos ** 2)
+    ss = weights.dot(sin ** 2)
+    cs = weights.dot(cos * sin)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        power = (ss * yc ** 2 + cc * ys ** 2 - 2 * cs * yc * ys) / (cc * ss - cs ** 2)
+        return power / (2 * variance[:, np.newaxis])
+
+
+if __name__ == '__main__':
+    pass
@@ -108,6 +108,12 @@ def read_key(keyfile):
     # split the controls into a list
     protocol_dict['control_genotype'] = [x.strip() for x in protocol_dict['control_genotype'].split(',')]
 
+    # bins are laid out per day, so they must divide a day evenly
+    assert (protocol_dict['bin'] > 0 and
+            analyze.MINUTES_PER_DAY % protocol_dict['bin'] == 0), \
+            'bin must divide a day (%d minutes) evenly, ex. 5, 15, 30, or 60.' % \
+            analyze.MINUTES_PER_DAY
+
     # check other protocol values
     assert (protocol_dict['DD'] >= 0), \
             'DD must be a positive integer.'
@@ -289,5 +295,27 @@ def write_data(protocol_dict, DEnM_df, data_dict, outname):
         output_df[genotype + '_N'] = df.shape[1]
     output_df.to_excel(outname)
 
+
+def write_daily_totals(protocol_dict, DEnM_df, data_dict, outname):
+    """
+    Write per-fly L, D, and total sums for each day to disk.  Totals with
+    missing minutes are left blank.
+
+    write_daily_totals(protocol_dict, DEnM_df, data_dict, outname) -> None
+
+    input protocol_dict: protocol settings stored as key->value pairs
+    input DEnM_df:       pd.dataframe of DEnM data
+    input data_dict:     activity_dict or sleep_dict
+    input outname:       name to use for output file
+    """
+
+    totals_dict = analyze.calculate_daily_totals(protocol_dict, DEnM_df, data_dict)
+    if not totals_dict:
+        return
+    output_df = pd.concat([totals_dict[genotype] for genotype in sorted(totals_dict)],
+                          keys=sorted(totals_dict), names=['genotype', 'fly'])
+    output_df.columns = ['day%d_%s' % column for column in output_df.columns]
+    output_df.to_excel(outname)
+
 if __name__ == '__main__':
     pass
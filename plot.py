@@ -15,6 +15,8 @@ import analyze
 
 
 COLOR_CYCLE = ['k', 'r', 'b', 'g', 'm', 'c']
+HEATMAP_CMAPS = {'activity': 'Greys', 'sleep': 'Blues'}
+PAGE_GRID = (6, 4)  # rows and columns of panels per page
 
 
 def metadata(protocol_dict, DEnM_df):
@@ -89,17 +91,19 @@ def metadata(protocol_dict, DEnM_df):
     pdf.close()
 
 
-def data(protocol_dict, DEnM_df, data_dict, genotype_list, data_type):
+def data(protocol_dict, DEnM_df, data_dict, genotype_list, data_type, ylim=None):
     """
     Plot data for arbitrarily many lines on one graph.
 
-    data(protocol_dict, DEnM_df, data_dict, genotype_list, data_type) -> None
+    data(protocol_dict, DEnM_df, data_dict, genotype_list, data_type, ylim) -> None
 
     input protocol_dict: information about the protocol used for this experiment
     input DEnM_df:       pd.dataframe of data from DEnM file
     input data_dict:     activity_dict or sleep_dict
     input genotype_list: list of genotypes to plot
     input data_type:     'activity' or 'sleep'
+    input ylim:          (bottom, top) y limits, ex. from data_limits; fixed
+                         defaults for data_type if None
     """
 
     (dates, start_date, end_date) = analyze.calculate_dates(protocol_dict, DEnM_df)
@@ -122,7 +126,9 @@ def data(protocol_dict, DEnM_df, data_dict, genotype_list, data_type):
     # plot decorations/parameters based on plot type
     plot_decorations = {'activity': ('beam crossings per ' + str(protocol_dict['bin']) + ' minutes', (0, 100)),
                         'sleep':    ('minutes sleep per ' + str(protocol_dict['bin']) + ' minutes', (0, 30))}
-    (ylabel, ylim) = plot_decorations[data_type]
+    (ylabel, default_ylim) = plot_decorations[data_type]
+    if ylim is None:
+        ylim = default_ylim
     light_bar = ylim[1]
 
     # other plot parameters
@@ -189,5 +195,165 @@ def data(protocol_dict, DEnM_df, data_dict, genotype_list, data_type):
     pdf.close()
 
 
+def data_limits(protocol_dict, DEnM_df, data_dict, data_type):
+    """
+    Return y limits that fit the binned mean + SEM of every genotype in
+    data_dict, rounded up to a round number, so that all plots of data_type
+    share one scale.  Sleep limits never exceed the bin size.
+
+    data_limits(protocol_dict, DEnM_df, data_dict, data_type) -> (bottom, top)
+
+    input protocol_dict: information about the protocol used for this experiment
+    input DEnM_df:       pd.dataframe of data from DEnM file
+    input data_dict:     activity_dict or sleep_dict
+    input data_type:     'activity' or 'sleep'
+    output (bottom, top): y limits
+    """
+
+    top = 0
+    for genotype in data_dict:
+        binned = analyze.bin_by_day(protocol_dict, DEnM_df, data_dict[genotype],
+                                    protocol_dict['bin'])
+        n = (~np.isnan(binned)).sum(axis=2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sem = np.nanstd(binned, axis=2, ddof=1) / np.sqrt(n)
+            upper = np.nanmean(binned, axis=2) + np.where(np.isfinite(sem), sem, 0)
+        if np.isfinite(upper).any():
+            top = max(top, np.nanmax(upper))
+    if top <= 0:
+        top = 1
+
+    # round up to 1, 2, 2.5, or 5 times a power of ten
+    magnitude = 10 ** math.floor(math.log10(top))
+    top = min(step * magnitude for step in [1, 2, 2.5, 5, 10] if step * magnitude >= top)
+    if data_type == 'sleep':
+        top = min(top, protocol_dict['bin'])
+    return (0, top)
+
+
+def panels(protocol_dict, DEnM_df, data_dict, data_type, ylim=None):
+    """
+    Plot the mean binned data of every genotype as a day x time heatmap, with
+    many genotypes per page in a single pdf.  Heatmaps are rasterized, so the
+    pdf stays small however many flies are in the screen.
+
+    panels(protocol_dict, DEnM_df, data_dict, data_type, ylim) -> None
+
+    input protocol_dict: information about the protocol used for this experiment
+    input DEnM_df:       pd.dataframe of data from DEnM file
+    input data_dict:     activity_dict or sleep_dict
+    input data_type:     'activity' or 'sleep'
+    input ylim:          (bottom, top) color scale limits, from data_limits
+                         if None
+    """
+
+    if ylim is None:
+        ylim = data_limits(protocol_dict, DEnM_df, data_dict, data_type)
+
+    images = []
+    titles = []
+    for genotype in sorted(data_dict):
+        binned = analyze.bin_by_day(protocol_dict, DEnM_df, data_dict[genotype],
+                                     protocol_dict['bin'])
+        images.append(np.nanmean(binned, axis=2))
+        titles.append(' '.join([genotype, 'N=' + str(binned.shape[2])]))
+
+    savename = '_'.join([protocol_dict['effector'], protocol_dict['gender'], data_type, 'panels.pdf'])
+    _heatmap_pages(protocol_dict, images, titles, 24, data_type, ylim, savename)
+
+
+def actograms(protocol_dict, DEnM_df, data_dict, data_type, ylim=None):
+    """
+    Plot a double-plotted actogram for every individual fly, as rasterized
+    heatmaps with many flies per page in a single pdf.  Row n shows days n and
+    n + 1.
+
+    actograms(protocol_dict, DEnM_df, data_dict, data_type, ylim) -> None
+
+    input protocol_dict: information about the protocol used for this experiment
+    input DEnM_df:       pd.dataframe of data from DEnM file
+    input data_dict:     activity_dict or sleep_dict
+    input data_type:     'activity' or 'sleep'
+    input ylim:          (bottom, top) color scale limits, from data_limits
+                         if None
+    """
+
+    if ylim is None:
+        ylim = data_limits(protocol_dict, DEnM_df, data_dict, data_type)
+
+    images = []
+    titles = []
+    for genotype in sorted(data_dict):
+        binned = analyze.bin_by_day(protocol_dict, DEnM_df, data_dict[genotype],
+                                     protocol_dict['bin'])
+        # the second half of each row is the following day; blank after the last
+        following = np.concatenate((binned[1:], np.nan * binned[:1]), axis=0)
+        double = np.concatenate((binned, following), axis=1)
+        for fly, channel in enumerate(data_dict[genotype].columns):
+            images.append(double[:, :, fly])
+            titles.append(' '.join([genotype, channel]))
+
+    savename = '_'.join([protocol_dict['effector'], protocol_dict['gender'], data_type, 'actograms.pdf'])
+    _heatmap_pages(protocol_dict, images, titles, 48, data_type, ylim, savename)
+
+
+def _heatmap_pages(protocol_dict, images, titles, hours, data_type, ylim, savename):
+    """
+    Draw each day x bin image as a rasterized heatmap in a PAGE_GRID of panels
+    per page, with one shared color scale, and save to a multi-page pdf.
+
+    _heatmap_pages(protocol_dict, images, titles, hours, data_type, ylim, savename) -> None
+
+    input protocol_dict: information about the protocol used for this experiment
+    input images:        list of np.arrays, days x bins
+    input titles:        list of panel titles
+    input hours:         hours spanned by each row, 24 or 48 (double-plotted)
+    input data_type:     'activity' or 'sleep'
+    input ylim:          (bottom, top) color scale limits
+    input savename:      name to use for output file
+    """
+
+    cbar_labels = {'activity': 'beam crossings per ' + str(protocol_dict['bin']) + ' minutes',
+                   'sleep':    'minutes sleep per ' + str(protocol_dict['bin']) + ' minutes'}
+    lights_off = (protocol_dict['lights_off'].hour - protocol_dict['lights_on'].hour) % 24
+
+    if not images:
+        return
+
+    pdf = PdfPages(savename)
+    (rows, cols) = PAGE_GRID
+    per_page = rows * cols
+    for page_start in range(0, len(images), per_page):
+        fig, axes = plt.subplots(rows, cols, figsize=(8.5, 11), squeeze=False)
+        axes = axes.ravel()
+        for ax, image, title in zip(axes, images[page_start:page_start + per_page],
+                                    titles[page_start:page_start + per_page]):
+            im = ax.imshow(np.ma.masked_invalid(image), aspect='auto',
+                           interpolation='nearest', cmap=HEATMAP_CMAPS[data_type],
+                           vmin=ylim[0], vmax=ylim[1],
+                           extent=(0, hours, image.shape[0] + 0.5, 0.5),
+                           rasterized=True)
+            # mark lights off (and the next lights on when double-plotted)
+            for hour in range(0, hours, 24):
+                ax.axvline(hour + lights_off, color='r', linewidth=0.5)
+                if hour:
+                    ax.axvline(hour, color='y', linewidth=0.5)
+            ax.set_title(title, fontsize='xx-small')
+            ax.set_xticks(range(0, hours + 1, 6 if hours == 24 else 12))
+            ax.set_yticks(range(1, image.shape[0] + 1))
+            ax.tick_params(labelsize='xx-small')
+        for ax in axes[len(images) - page_start:]:
+            ax.axis('off')
+        fig.text(0.5, 0.01, 'hours after lights on', ha='center', fontsize='small')
+        fig.text(0.01, 0.5, 'day', va='center', rotation='vertical', fontsize='small')
+        cbar = fig.colorbar(im, ax=axes.tolist(), fraction=0.02, pad=0.02)
+        cbar.set_label(cbar_labels[data_type], fontsize='small')
+
+        # save page to pdf and close figure
+        pdf.savefig(fig)
+        plt.close(fig)
+    pdf.close()
+
+
 if __name__ == '__main__':
     pass
@@ -5,10 +5,13 @@ import os
 import shutil
 import errno
 import datetime as dt
+import pandas as pd
 
 import file_io
 import analyze
+import circadian
 import plot
+import stats
 
 
 def datestamp(time=True):
@@ -53,10 +56,16 @@ def main():
 
         After the construction of these dictionaries, plots are produced for the
         experimental metadata as well as sleep and activity for each line vs all
-        controls.  Other plot types are included in the plot.y module, but not
+        controls (unless line_plots is 0 in the config file), heatmap panels of
+        every genotype, and, if actograms is 1 in the config file,
+        double-plotted actograms of every fly.  Other plot types are included in the plot.y module, but not
         implemented in this script.
 
-        The activity and sleep dictionaries are written as .xls files for later use.
+        The activity and sleep dictionaries are written as .xls files for later use,
+        along with per-fly L/D/total sums for each day, statistics comparing
+        each line to the controls and, if the experiment includes DD, circadian
+        periods and rhythmicity.  Mean sleep per day is also written for
+        inactivity thresholds of 1 to 30 minutes.
         """
 
     # read the configuration file
@@ -73,13 +82,22 @@ def main():
     dam_monitors = set(item[0] for sublist in genotype_dict.itervalues() for item in sublist)
     DAM_dict = {'M' + str(monitor): file_io.read_DAM_data(monitor, config_dict['max_monitor']) for monitor in dam_monitors}
 
+    # put every monitor on the same minute grid, recording gaps and
+    # duplicate readings so that sleep isn't inferred across missing data
+    (DAM_dict, gaps) = analyze.align_monitors(DEnM_df, DAM_dict)
+    gaps_filename = key[:-4] + '_gaps' + '.txt'
+    with open(gaps_filename, "w") as myfile:
+        myfile.write('\n'.join('\t'.join([monitor, kind, str(start), str(minutes)])
+                               for (monitor, kind, start, minutes) in gaps))
+
     # sort/collect data by genotype and create activity dict
     activity_dict = analyze.aggregate_by_genotype(genotype_dict, config_dict, DEnM_df, DAM_dict)
     # mark and remove dead fly data so that it isn't plotted
-    dead_flies = analyze.mark_dead_flies(protocol_dict, DEnM_df, activity_dict, genotype_dict)
+    # (flies without enough data on check_day are kept, and listed as undetermined)
+    (dead_flies, undetermined_flies) = analyze.mark_dead_flies(protocol_dict, DEnM_df, activity_dict, genotype_dict)
     dead_flies_filename = key[:-4] + '_dead_flies' + '.txt'
     with open(dead_flies_filename, "a") as myfile:
-        myfile.write('\n'.join(dead_flies))
+        myfile.write('\n'.join(dead_flies + [fly + '\tundetermined' for fly in undetermined_flies]))
     # create sleep dict from activity dict
     sleep_dict = analyze.calculate_sleep(activity_dict)
 
@@ -92,25 +110,67 @@ def main():
             raise
     shutil.copy(key, f) # copy key file to output folder
     shutil.move(dead_flies_filename, f) # move dead_flies file to output folder
+    shutil.move(gaps_filename, f) # move gaps file to output folder
     os.chdir(f) # move into the output folder, so all subsequent files will be saved there
 
     # plot the DEnM data, including light intensity, temperature, and relative humidity
     plot.metadata(protocol_dict, DEnM_df)
 
-    # plot the activity and sleep of each genotype individually, with all controls
+    # plot the activity and sleep of each genotype individually, with all controls,
+    # on y axes scaled to the data of the whole experiment
+    activity_ylim = plot.data_limits(protocol_dict, DEnM_df, activity_dict, 'activity')
+    sleep_ylim = plot.data_limits(protocol_dict, DEnM_df, sleep_dict, 'sleep')
+    # (one multi-page pdf per genotype, so large screens can turn these off)
     controls = list()
     if set(protocol_dict['control_genotype']) & set(genotype_dict.keys()):
         controls = protocol_dict['control_genotype']
-    for genotype in genotype_dict.keys():
-        if genotype not in protocol_dict['control_genotype']:
-            genotype_list = list(controls)
-            genotype_list.append(genotype)
-            plot.data(protocol_dict, DEnM_df, activity_dict, genotype_list, 'activity')
-            plot.data(protocol_dict, DEnM_df, sleep_dict, genotype_list, 'sleep')
+    if config_dict.get('line_plots', 1):
+        for genotype in genotype_dict.keys():
+            if genotype not in protocol_dict['control_genotype']:
+                genotype_list = list(controls)
+                genotype_list.append(genotype)
+                plot.data(protocol_dict, DEnM_df, activity_dict, genotype_list, 'activity', activity_ylim)
+                plot.data(protocol_dict, DEnM_df, sleep_dict, genotype_list, 'sleep', sleep_ylim)
+
+    # plot every genotype as a heatmap on a few pages, and every individual fly
+    # as an actogram if asked for
+    for (data_type, data_dict, ylim) in [('activity', activity_dict, activity_ylim),
+                                         ('sleep', sleep_dict, sleep_ylim)]:
+        plot.panels(protocol_dict, DEnM_df, data_dict, data_type, ylim)
+        if config_dict.get('actograms', 0):
+            plot.actograms(protocol_dict, DEnM_df, data_dict, data_type, ylim)
 
     # write the data to excel files
     file_io.write_data(protocol_dict, DEnM_df, activity_dict, key[:-4] + '_activity.xls')
     file_io.write_data(protocol_dict, DEnM_df, sleep_dict, key[:-4] + '_sleep.xls')
+    file_io.write_daily_totals(protocol_dict, DEnM_df, activity_dict, key[:-4] + '_activity_per_fly.xls')
+    file_io.write_daily_totals(protocol_dict, DEnM_df, sleep_dict, key[:-4] + '_sleep_per_fly.xls')
+
+    # compare each line to the controls, per day and L/D phase, and write the
+    # statistics alongside the data
+    resamples = config_dict.get('resamples', 10000)
+    processes = config_dict.get('processes', 1)
+    for (data_type, data_dict) in [('activity', activity_dict), ('sleep', sleep_dict)]:
+        stats_df = stats.compare_to_controls(protocol_dict, DEnM_df, data_dict,
+                                             genotype_dict.keys(), resamples, processes)
+        if not stats_df.empty:
+            stats_df.to_excel(key[:-4] + '_' + data_type + '_stats.xls')
+
+    # mean sleep per day for every genotype across a range of inactivity
+    # thresholds, to check how robust the sleep results are
+    sleep_cube = analyze.sweep_sleep_thresholds(protocol_dict, DEnM_df, activity_dict,
+                                                processes=processes)
+    if not sleep_cube.empty:
+        sleep_cube.to_excel(key[:-4] + '_sleep_thresholds.xls')
+
+    # analyze free-running rhythms in DD, per fly and per genotype
+    (rhythm_df, rhythm_summary_df) = circadian.analyze_rhythms(protocol_dict, DEnM_df, activity_dict,
+                                                               processes=processes)
+    if not rhythm_df.empty:
+        writer = pd.ExcelWriter(key[:-4] + '_rhythms.xls')
+        rhythm_summary_df.to_excel(writer, 'genotypes')
+        rhythm_df.to_excel(writer, 'flies')
+        writer.save()
 
 # Standard boilerplate to call the main() function to begin
 # the program.
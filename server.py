@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+"""
+Created on Oct 19, 2026
+"""
+
+import BaseHTTPServer
+import collections
+import json
+import os
+import sys
+import threading
+import time
+import urlparse
+
+import numpy as np
+import pandas as pd
+import file_io
+import analyze
+
+
+CACHE_SIZE = 128     # derived results kept in memory
+POLL_INTERVAL = 5    # seconds between checks for changed input files
+DEFAULT_PORT = 8000
+
+
+class LRUCache(object):
+    """
+    A bounded mapping that forgets the least recently used entry when full.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+
+    def get(self, key):
+        """Return the value for key, or None, and mark key as recently used."""
+        if key not in self._data:
+            return None
+        value = self._data.pop(key)
+        self._data[key] = value
+        return value
+
+    def put(self, key, value):
+        """Store value for key, evicting the oldest entry if over maxsize."""
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        """Forget every entry."""
+        self._data.clear()
+
+
+class Experiment(object):
+    """
+    An experiment loaded into memory once, answering queries from its
+    activity and sleep matrices.  Query results are cached by query
+    parameters, and the experiment is reloaded (and the cache cleared) when
+    the config file, key file, or any monitor file changes.
+    """
+
+    def __init__(self, config, key, cache_size=CACHE_SIZE):
+        self.config = config
+        self.key = key
+        self.cache = LRUCache(cache_size)
+        self.lock = threading.Lock()
+        self.mtimes = dict()
+        self.load()
+
+    def load(self):
+        """
+        Read and process the experiment the same way process_experiment.py
+        does.  Dead flies are removed from activity_dict and sleep_dict, but
+        all_activity_dict keeps them for dead fly queries.
+        """
+
+        # take each file's mtime before reading it, so that a file changed
+        # while loading is seen as changed by the next poll
+        mtimes = _mtimes([self.config, self.key])
+        config_dict = file_io.read_config(self.config)
+        (protocol_dict, genotype_dict) = file_io.read_key(self.key)
+        dam_monitors = set(item[0] for sublist in genotype_dict.itervalues() for item in sublist)
+        mtimes.update(_mtimes('Monitor' + str(monitor) + '.txt'
+                              for monitor in [protocol_dict['DEnM']] + sorted(dam_monitors)))
+        DEnM_df = file_io.read_DEnM_data(protocol_dict['DEnM'], config_dict['env_monitors'])
+        DAM_dict = {'M' + str(monitor): file_io.read_DAM_data(monitor, config_dict['max_monitor'])
+                    for monitor in dam_monitors}
+        (DAM_dict, gaps) = analyze.align_monitors(DEnM_df, DAM_dict)
+        all_activity_dict = analyze.aggregate_by_genotype(genotype_dict, config_dict, DEnM_df, DAM_dict)
+        activity_dict = {genotype: df.copy() for (genotype, df) in all_activity_dict.iteritems()}
+        analyze.mark_dead_flies(protocol_dict, DEnM_df, activity_dict, dict(genotype_dict))
+
+        # swap in the new state all at once
+        with self.lock:
+            self.protocol_dict = protocol_dict
+            self.DEnM_df = DEnM_df
+            self.gaps = gaps
+            self.all_activity_dict = all_activity_dict
+            self.data = {'activity': activity_dict,
+                         'sleep': analyze.calculate_sleep(activity_dict)}
+            self.mtimes = mtimes
+            self.cache.clear()
+
+    def changed(self):
+        """True if any input file was modified, added, or removed since loading."""
+        for path, mtime in self.mtimes.iteritems():
+            if _mtime(path) != mtime:
+                return True
+        return False
+
+    def watch(self, interval=POLL_INTERVAL):
+        """Poll the input files in a daemon thread and reload on change."""
+        def poll():
+            while True:
+                time.sleep(interval)
+                if self.changed():
+                    print 'Input files changed, reloading experiment.'
+                    try:
+                        self.load()
+                    except Exception as exception:  # keep serving the old data
+                        print 'Reload failed: %s' % exception
+        thread = threading.Thread(target=poll)
+        thread.daemon = True
+        thread.start()
+
+    def query(self, name, params):
+        """
+        Return the JSON result of query name with params, from the cache if
+        possible.  Raises KeyError for unknown queries or genotypes and
+        ValueError for bad parameters.
+        """
+
+        cache_key = (name, tuple(sorted(params.iteritems())))
+        with self.lock:
+            result = self.cache.get(cache_key)
+            if result is None:
+                result = QUERIES[name](self, params)
+                self.cache.put(cache_key, result)
+        return result
+
+    def genotypes(self, params):
+        """Living flies per genotype."""
+        return json.dumps({genotype: df.shape[1]
+                           for (genotype, df) in self.data['activity'].iteritems()})
+
+    def daily(self, params):
+        """
+        Per-fly L, D, and total sums for each day.
+        params: genotype, data ('activity' or 'sleep', default 'sleep')
+        """
+
+        data_dict = self.data[params.get('data', 'sleep')]
+        genotype = params['genotype']
+        totals = analyze.calculate_daily_totals(self.protocol_dict, self.DEnM_df,
+                                                {genotype: data_dict[genotype]})[genotype]
+        totals.columns = ['day%d_%s' % column for column in totals.columns]
+        return totals.to_json(orient='split')
+
+    def binned(self, params):
+        """
+        Mean, SEM, and N across flies in each bin of each day.
+        params: genotype, data ('activity' or 'sleep', default 'sleep'),
+        bin (minutes, default the protocol bin)
+        """
+
+        data_dict = self.data[params.get('data', 'sleep')]
+        genotype = params['genotype']
+        bin_minutes = int(params.get('bin', self.protocol_dict['bin']))
+        if bin_minutes <= 0 or analyze.MINUTES_PER_DAY % bin_minutes:
+            raise ValueError('bin must divide a day evenly.')
+        binned = analyze.bin_by_day(self.protocol_dict, self.DEnM_df,
+                                    data_dict[genotype], bin_minutes)
+        (__, start_date, __) = analyze.calculate_dates(self.protocol_dict, self.DEnM_df)
+        index = pd.date_range(start_date, periods=binned.shape[0] * binned.shape[1],
+                              freq=str(bin_minutes) + 'Min')
+        flies = binned.reshape(-1, binned.shape[2])
+        n = (~np.isnan(flies)).sum(axis=1)
+        df = pd.DataFrame({'mean': np.nanmean(flies, axis=1),
+                           'sem': np.nanstd(flies, axis=1, ddof=1) / np.sqrt(n),
+                           'N': n},
+                          index=index, columns=['mean', 'sem', 'N'])
+        return df.to_json(orient='split', date_format='iso')
+
+    def dead_flies(self, params):
+        """
+        Flies with at most threshold beam crossings on check_day, and flies
+        with too little data on check_day to tell.
+        params: threshold (default 0)
+        """
+
+        threshold = float(params.get('threshold', 0))
+        (dead, undetermined) = analyze.find_dead_flies(self.protocol_dict, self.DEnM_df,
+                                                       self.all_activity_dict, threshold)
+        return json.dumps({'dead': ['_'.join(fly) for fly in dead],
+                           'undetermined': ['_'.join(fly) for fly in undetermined]})
+
+    def gap_list(self, params):
+        """Gaps and duplicate readings found when aligning the monitors."""
+        return json.dumps([(monitor, kind, str(start), minutes)
+                           for (monitor, kind, start, minutes) in self.gaps])
+
+
+def _mtime(path):
+    """Return the modification time of path, or None if it doesn't exist."""
+    if os.path.isfile(path):
+        return os.path.getmtime(path)
+    return None
+
+
+def _mtimes(paths):
+    """
+    Return modification times of paths, keyed by path, with None for files
+    that don't exist (yet).
+    """
+    return {path: _mtime(path) for path in paths}
+
+
+# query name (URL path) -> Experiment method
+QUERIES = {'genotypes': Experiment.genotypes,
+           'daily': Experiment.daily,
+           'binned': Experiment.binned,
+           'dead_flies': Experiment.dead_flies,
+           'gaps': Experiment.gap_list}
+
+
+class QueryHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answer GET /<query>?param=value&... with JSON from the server's experiment.
+    """
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        name = url.path.strip('/')
+        params = {k: v[-1] for (k, v) in urlparse.parse_qs(url.query).iteritems()}
+        if name not in QUERIES:
+            self._respond(404, json.dumps({'error': 'unknown query %s' % name,
+                                           'queries': sorted(QUERIES)}))
+            return
+        try:
+            result = self.server.experiment.query(name, params)
+        except KeyError as exception:
+            self._respond(400, json.dumps({'error': 'unknown or missing %s' % exception}))
+            return
+        except ValueError as exception:
+            self._respond(400, json.dumps({'error': str(exception)}))
+            return
+        except Exception as exception:  # answer rather than drop the connection
+            self._respond(500, json.dumps({'error': '%s: %s' % (type(exception).__name__,
+                                                                exception)}))
+            return
+        self._respond(200, result)
+
+    def _respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    # Command line args are in sys.argv[1], sys.argv[2] ..
+    # sys.argv[0] is the script name itself and can be ignored
+    if len(sys.argv) == 2:
+        directory = os.path.dirname(os.path.realpath(__file__))
+        config = os.path.join(directory, 'config.ini')
+        key = sys.argv[1]
+    elif len(sys.argv) > 2:
+        config = sys.argv[1]
+        key = sys.argv[2]
+    else:
+        print """
+        usage: python server.py [config_file] key_file
+
+        Load an experiment once and answer queries about it over HTTP on
+        localhost, from the folder containing the monitor files.  The port is
+        server_port in the config file (default 8000).  Results are cached,
+        and the experiment is reloaded when the config, key, or monitor
+        files change.
+
+        Queries (JSON responses):
+        /genotypes                                  living flies per genotype
+        /daily?genotype=X&data=sleep                per-fly L/D/total per day
+        /binned?genotype=X&data=sleep&bin=15        mean/sem/N per bin
+        /dead_flies?threshold=Y                     flies with <= Y crossings on check_day
+        /gaps                                       gaps and duplicate readings
+        """
+        return
+
+    experiment = Experiment(config, key)
+    experiment.watch()
+    port = file_io.read_config(config).get('server_port', DEFAULT_PORT)
+    httpd = BaseHTTPServer.HTTPServer(('localhost', port), QueryHandler)
+    httpd.experiment = experiment
+    print 'Serving %s on http://localhost:%d/' % (key, port)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        httpd.server_close()
+
+# Standard boilerplate to call the main() function to begin
+# the program.
+if __name__ == '__main__':
+    main()
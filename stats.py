@@ -0,0 +1,202 @@
+"""
+Created on Oct 19, 2026
+"""
+
+import numpy as np
+import pandas as pd
+import analyze
+
+
+BATCH_SIZE = 1000  # resamples drawn at a time, bounds memory per comparison
+RESULT_COLUMNS = ['N', 'control_N', 'mean', 'control_mean', 'difference',
+                  'ci_low', 'ci_high', 'hedges_g', 'p']
+
+
+def compare_to_controls(protocol_dict, DEnM_df, data_dict, genotype_list,
+                        resamples=10000, processes=1, seed=0, alpha=0.05):
+    """
+    Compare the per-day L, D, and total sums of every genotype in
+    genotype_list against every control genotype.  For each (genotype,
+    control, day, phase) this reports the difference in means, a bootstrap
+    confidence interval for the difference, Hedges' g, and a two-sided
+    permutation p value.  Flies missing data for a (day, phase) are left out of
+    that comparison, so N can differ between rows.  p values are corrected
+    across all comparisons with Benjamini-Hochberg.  Comparisons are
+    independent, so with processes > 1 they are spread over a process pool.
+
+    compare_to_controls(protocol_dict, DEnM_df, data_dict, genotype_list,
+                        resamples, processes, seed, alpha) -> stats_df
+
+    input protocol_dict: information about the protocol used for this experiment
+    input DEnM_df:       pd.dataframe of data from DEnM file
+    input data_dict:     activity_dict or sleep_dict
+    input genotype_list: list of genotypes to test against the controls
+    input resamples:     number of bootstrap and permutation resamples
+    input processes:     number of worker processes
+    input seed:          seed for the random number generator
+    input alpha:         significance level for CIs and corrected p values
+    output stats_df:     pd.dataframe with one row per comparison
+    """
+
+    controls = [control for control in protocol_dict['control_genotype']
+                if control in data_dict]
+    totals_dict = analyze.calculate_daily_totals(protocol_dict, DEnM_df, data_dict)
+
+    # each job is one genotype vs one control, over all (day, phase) columns
+    jobs = []
+    for genotype in genotype_list:
+        if genotype in controls or genotype not in data_dict:
+            continue
+        for control in controls:
+            jobs.append((genotype, control,
+                         totals_dict[genotype].values,
+                         totals_dict[control].values,
+                         resamples, seed + len(jobs), alpha))
+    if not jobs:
+        return pd.DataFrame()
+
+    results = analyze.map_jobs(_compare, jobs, processes)
+
+    # one row per (genotype, control, day, phase)
+    columns = totals_dict[jobs[0][0]].columns
+    frames = []
+    for (genotype, control, __, __, __, __, __), result in zip(jobs, results):
+        df = pd.DataFrame(result, index=columns, columns=RESULT_COLUMNS).reset_index()
+        df.insert(0, 'control', control)
+        df.insert(0, 'genotype', genotype)
+        frames.append(df)
+    stats_df = pd.concat(frames, ignore_index=True)
+    stats_df['p_adjusted'] = benjamini_hochberg(stats_df['p'].values)
+    stats_df['significant'] = stats_df['p_adjusted'] < alpha
+    return stats_df
+
+
+def _compare(job):
+    """
+    Bootstrap and permutation statistics for one genotype vs one control.
+    Flies with a missing (NaN) total are left out of that column only, and
+    columns with fewer than two flies left in either group are reported with
+    their N but no statistics.
+
+    _compare(job) -> result_dict
+
+    input job:          (genotype, control, test values, control values,
+                         resamples, seed, alpha); values are fly x column arrays
+    output result_dict: column name as key and np.array over columns as value
+    """
+
+    (__, __, test, control, resamples, seed, alpha) = job
+    rng = np.random.RandomState(seed)
+    test_valid = ~np.isnan(test)
+    control_valid = ~np.isnan(control)
+
+    result = {name: np.nan * np.ones(test.shape[1]) for name in RESULT_COLUMNS}
+    result['N'] = test_valid.sum(axis=0)
+    result['control_N'] = control_valid.sum(axis=0)
+
+    # columns missing the same flies (usually all of them) are resampled together
+    groups = dict()
+    for column, pattern in enumerate(np.vstack((test_valid, control_valid)).T):
+        groups.setdefault(pattern.tostring(), []).append(column)
+    for columns in groups.itervalues():
+        test_rows = test_valid[:, columns[0]]
+        control_rows = control_valid[:, columns[0]]
+        if test_rows.sum() < 2 or control_rows.sum() < 2:
+            continue
+        group_result = _resample(test[test_rows][:, columns],
+                                 control[control_rows][:, columns],
+                                 resamples, rng, alpha)
+        for name, values in group_result.iteritems():
+            result[name][columns] = values
+    return result
+
+
+def _resample(test, control, resamples, rng, alpha):
+    """
+    Bootstrap CI, permutation p value, and Hedges' g for every column of
+    complete fly x column arrays test and control.
+
+    _resample(test, control, resamples, rng, alpha) -> result_dict
+    """
+
+    n_test = test.shape[0]
+    n_control = control.shape[0]
+    pooled = np.vstack((test, control))
+    observed = test.mean(axis=0) - control.mean(axis=0)
+
+    # draw all resamples for a batch at once as index matrices and average
+    # along the fly axis, giving a (resample, column) matrix per batch
+    boot = []
+    exceed = np.zeros(test.shape[1])
+    for size in _batches(resamples):
+        test_index = rng.randint(0, n_test, (size, n_test))
+        control_index = rng.randint(0, n_control, (size, n_control))
+        boot.append(test[test_index].mean(axis=1) -
+                    control[control_index].mean(axis=1))
+
+        # a random permutation per row: argsort of uniform noise
+        permutation = np.argsort(rng.rand(size, n_test + n_control), axis=1)
+        shuffled = pooled[permutation]
+        null = (shuffled[:, :n_test].mean(axis=1) -
+                shuffled[:, n_test:].mean(axis=1))
+        exceed += (np.abs(null) >= np.abs(observed)).sum(axis=0)
+    boot = np.vstack(boot)
+
+    # Hedges' g, using the pooled standard deviation; undefined (NaN) when
+    # both groups have zero variance
+    dof = n_test + n_control - 2
+    pooled_sd = np.sqrt(((n_test - 1) * test.var(axis=0, ddof=1) +
+                         (n_control - 1) * control.var(axis=0, ddof=1)) / dof)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g = np.where(pooled_sd > 0,
+                     observed / pooled_sd * (1 - 3.0 / (4 * dof - 1)), np.nan)
+
+    return {'mean': test.mean(axis=0),
+            'control_mean': control.mean(axis=0),
+            'difference': observed,
+            'ci_low': np.percentile(boot, 100 * alpha / 2, axis=0),
+            'ci_high': np.percentile(boot, 100 * (1 - alpha / 2), axis=0),
+            'hedges_g': g,
+            'p': (exceed + 1) / (resamples + 1.0)}
+
+
+def _batches(resamples):
+    """
+    Split resamples into batch sizes of at most BATCH_SIZE.
+
+    _batches(resamples) -> batch_sizes
+    """
+
+    sizes = [BATCH_SIZE] * (resamples // BATCH_SIZE)
+    if resamples % BATCH_SIZE:
+        sizes.append(resamples % BATCH_SIZE)
+    return sizes
+
+
+def benjamini_hochberg(p):
+    """
+    Return Benjamini-Hochberg adjusted p values (false discovery rate).
+    NaN p values (untested comparisons) stay NaN and aren't counted.
+
+    benjamini_hochberg(p) -> p_adjusted
+
+    input p:           np.array of p values
+    output p_adjusted: np.array of adjusted p values, in the same order as p
+    """
+
+    p = np.asarray(p, dtype=float)
+    p_adjusted = np.nan * np.ones(len(p))
+    tested = np.flatnonzero(~np.isnan(p))
+    n = len(tested)
+    if n == 0:
+        return p_adjusted
+    order = tested[np.argsort(p[tested])]
+    scaled = p[order] * n / np.arange(1, n + 1)
+    # enforce monotonicity from the largest p value down
+    scaled = np.minimum.accumulate(scaled[::-1])[::-1]
+    p_adjusted[order] = np.minimum(scaled, 1)
+    return p_adjusted
+
+
+if __name__ == '__main__':
+    pass